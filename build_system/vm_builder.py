@@ -10,22 +10,40 @@ build_machine.json must exist in the project root.
 
 Flow per VM:
   1. Optionally find a faster route via oroute
-  2. Rsync project root into a fresh tmp dir on the remote
-  3. Rsync script.sh into that same tmp dir
-  4. Execute script.sh with bash -e (cwd = tmp dir, exports/ expected at tmp/exports/)
+  2. Open an SSH ControlMaster connection that every later ssh/rsync reuses
+  3. Rsync project root into a fresh tmp dir on the remote
+  4. Stream script.sh over ssh stdin to bash -e (cwd = tmp dir, exports/ expected at tmp/exports/)
   5. Rsync tmp/exports/ back to ./builds/<vm_name>/
   6. Clean up tmp dir on success; leave it on failure for debugging
+
+Connection sharing is done by OpenSSH itself (ControlMaster/ControlPersist) with
+key auth through one ssh-agent, so each VM costs a single SSH handshake while
+transfers keep rsync's delta/compression and the script stays stdlib-only.
 """
 
 import os
 import sys
 import json
 import uuid
+import shlex
+import hashlib
+import time
+import shutil
+import tempfile
+import threading
+import contextlib
 import subprocess
 from pathlib import Path
+from typing import Optional
 from json.decoder import JSONDecodeError
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+try:
+    # Optional: faster JSON parsing; its JSONDecodeError subclasses the stdlib one
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 
 # ---------------------------------------------------------------------------
 # Sanity-check: we must be in build_system/ and project root must be its parent
@@ -66,30 +84,57 @@ if not os.access(script_path, os.R_OK):
 # Load VM configs
 # ---------------------------------------------------------------------------
 
-with open(BUILD_MACHINE_JSON, "r") as f:
-    VM_CONFIGS: list[dict] = json.load(f)
+with open(BUILD_MACHINE_JSON, "rb") as f:
+    VM_CONFIGS: list[dict] = json_loads(f.read())
+
+# Split "user@addr" once up front so later stages don't re-parse it
+for _config in VM_CONFIGS:
+    if "@" in _config.get("host", ""):
+        _config["_user"], _config["_addr"] = _config["host"].split("@", 1)
+
+
+# ---------------------------------------------------------------------------
+# Subprocess output: captured as bytes, decoded only where text is needed
+# ---------------------------------------------------------------------------
+
+def decode_output(data: Optional[bytes]) -> str:
+    """Decode captured subprocess output, tolerating invalid UTF-8."""
+    return data.decode("utf-8", "replace") if data else ""
+
+
+def tail_file(path: str, size: int = 4096) -> bytes:
+    """Last `size` bytes of a log file."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        return f.read()
 
 
 # ---------------------------------------------------------------------------
 # oroute: try to find a faster local route to each VM
 # ---------------------------------------------------------------------------
 
-OROUTE_BIN = "/usr/local/bin/oroute"
+# OROUTE_BIN env var wins, then PATH, then the usual install location
+OROUTE_BIN = os.environ.get("OROUTE_BIN") or shutil.which("oroute") or "/usr/local/bin/oroute"
+OROUTE_AVAILABLE = Path(OROUTE_BIN).is_file() and os.access(OROUTE_BIN, os.X_OK)
+
+# Upper bound on a single oroute probe so a hung one can't stall the resolver pool
+OROUTE_TIMEOUT = 3
 
 def resolve_host(config: dict) -> dict:
     """Return a (possibly updated) config with a faster local address if oroute finds one."""
-    config = dict(config)  # don't mutate the original
-    user_name, addr = config["host"].split("@", 1)
-    print(f"Finding a faster way to {addr}...")
-
-    if not Path(OROUTE_BIN).exists():
-        print(f"  oroute not found at {OROUTE_BIN}, skipping.")
+    if not OROUTE_AVAILABLE:
         return config
 
+    addr = config.get("_addr", config["host"])
+    print(f"Finding a faster way to {addr}...")
+
     try:
-        output = subprocess.check_output([OROUTE_BIN, "-sresolve", config["host"]])
+        output = subprocess.check_output(
+            [OROUTE_BIN, "-sresolve", config["host"]], timeout=OROUTE_TIMEOUT,
+        )
         try:
-            oroute_info = json.loads(output)
+            oroute_info = json_loads(output)
         except JSONDecodeError:
             # print(f"  Error decoding oRoute output: {output!r}")
             return config
@@ -97,7 +142,13 @@ def resolve_host(config: dict) -> dict:
         if oroute_info.get("reachable"):
             local_addr = oroute_info["local_address"]
             print(f"  Found a faster route → {local_addr}")
-            config["host"] = f"{user_name}@{local_addr}"
+            user_name = config.get("_user")
+            # copy on write — don't mutate the original
+            config = {
+                **config,
+                "host": f"{user_name}@{local_addr}" if user_name else local_addr,
+                "_addr": local_addr,
+            }
         else:
             print(f"  oRoute reports host unreachable, using original address.")
 
@@ -111,38 +162,28 @@ def resolve_host(config: dict) -> dict:
 # VM identity: auto-detect OS / arch for naming the output directory
 # ---------------------------------------------------------------------------
 
-def get_vm_identity(host: str, password: str) -> str:
+def get_vm_identity(host: str, ssh_opts: list[str]) -> str:
     """SSH into the VM and derive a human-readable identity string."""
-    env = {**os.environ, "SSHPASS": password}
-
     result = subprocess.run(
         [
-            "sshpass", "-e", "ssh",
-            "-o", "StrictHostKeyChecking=no",
-            "-o", "BatchMode=no",
+            "ssh", *ssh_opts,
             host,
-            "grep -E '^(ID=|VERSION_ID=)' /etc/os-release 2>/dev/null || echo 'ID=unknown'; "
-            "uname -m; "
-            "hostname",
+            "printf 'ARCH=%s\\n' \"$(uname -m)\"; "
+            "cat /etc/os-release 2>/dev/null; "
+            "printf 'HOST=%s\\n' \"$(hostname)\"",
         ],
-        env=env,
         capture_output=True,
-        text=True,
         check=True,
     )
 
-    lines = result.stdout.strip().split("\n")
-    os_id = "unknown"
-    version_id = ""
+    # Every line is KEY=value (os-release values may be quoted)
+    pairs = (line.split("=", 1) for line in decode_output(result.stdout).splitlines() if "=" in line)
+    info = {key.strip(): value.strip().strip('"') for key, value in pairs}
 
-    for line in lines:
-        if line.startswith("ID="):
-            os_id = line.split("=", 1)[1].strip('"')
-        elif line.startswith("VERSION_ID="):
-            version_id = line.split("=", 1)[1].strip('"')
-
-    arch = lines[-2].strip() if len(lines) >= 2 else "unknown"
-    hostname = lines[-1].strip() if lines else "unknown"
+    os_id = info.get("ID") or "unknown"
+    version_id = info.get("VERSION_ID", "")
+    arch = info.get("ARCH") or "unknown"
+    hostname = info.get("HOST") or "unknown"
 
     if os_id != "unknown" and version_id:
         name = f"{os_id}-{version_id}-{arch}"
@@ -154,14 +195,219 @@ def get_vm_identity(host: str, password: str) -> str:
     return name.replace(" ", "-").lower()
 
 
+# ---------------------------------------------------------------------------
+# SSH keys: public-key auth through a single ssh-agent for the whole run
+# ---------------------------------------------------------------------------
+
+# Key generated and installed (via ssh-copy-id) for VMs that only have a password
+DEFAULT_IDENTITY = Path.home() / ".ssh" / "wpd_build_ed25519"
+
+
+def identity_path(config: dict) -> Path:
+    """Private key used for a VM — its configured "identity", or the default build key."""
+    identity = config.get("identity")
+    return Path(identity).expanduser() if identity else DEFAULT_IDENTITY
+
+
+def ensure_default_identity() -> None:
+    """Generate the default build key if it doesn't exist yet."""
+    if DEFAULT_IDENTITY.exists():
+        return
+    print(f"Generating build key at {DEFAULT_IDENTITY}...")
+    DEFAULT_IDENTITY.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    subprocess.run(
+        ["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-C", "wpd-build",
+         "-f", str(DEFAULT_IDENTITY)],
+        check=True,
+    )
+
+
+SSH_AGENT_VARS = ("SSH_AUTH_SOCK", "SSH_AGENT_PID")
+
+
+@contextlib.contextmanager
+def ssh_agent(identities: set[Path]):
+    """
+    Run a private ssh-agent for the duration of the block, exported via os.environ,
+    with every key loaded. On exit only that agent is killed and the caller's own
+    agent variables are restored.
+    """
+    saved = {key: os.environ.get(key) for key in SSH_AGENT_VARS}
+    output = subprocess.check_output(["ssh-agent", "-s"])
+
+    agent_env = {}
+    for line in decode_output(output).splitlines():
+        # e.g. "SSH_AUTH_SOCK=/tmp/ssh-XXX/agent.123; export SSH_AUTH_SOCK;"
+        key, sep, rest = line.partition("=")
+        if sep and key in SSH_AGENT_VARS:
+            agent_env[key] = rest.split(";", 1)[0]
+
+    os.environ.update(agent_env)
+    try:
+        for identity in sorted(identities):
+            subprocess.run(["ssh-add", "-q", str(identity)], check=True)
+        yield
+    finally:
+        if "SSH_AGENT_PID" in agent_env:
+            subprocess.run(["ssh-agent", "-k"], env={**os.environ, **agent_env},
+                           stdout=subprocess.DEVNULL)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def provision_key(host: str, password: str) -> None:
+    """One-time install of the default build key on a password-only VM."""
+    subprocess.run(
+        ["sshpass", "-e", "ssh-copy-id", "-i", f"{DEFAULT_IDENTITY}.pub",
+         "-o", "StrictHostKeyChecking=no", host],
+        env={**os.environ, "SSHPASS": password},
+        check=True, capture_output=True,
+    )
+
+
+# ---------------------------------------------------------------------------
+# SSH multiplexing: one authenticated connection per host, shared by ssh/rsync
+# ---------------------------------------------------------------------------
+
+# Remote exit code used to signal "script succeeded but exports/ is missing"
+EXPORTS_MISSING_EXIT = 90
+
+# rsync: "partial transfer due to error" — what a missing source path produces
+RSYNC_PARTIAL_EXIT = 23
+
+# Remote side of the run step: the script arrives on stdin and is written into the tmp dir
+# first (not passed through argv, which caps a single argument at 128 KiB), then run with
+# stdin detached so nothing in it can swallow input; finally exports/ is checked.
+# bash -e: any command failure exits immediately and propagates non-zero back to us.
+REMOTE_RUN_CMD = (
+    "cd {tmp_dir} && cat > {script_name} && bash -e {script_name} </dev/null && "
+    "{{ [ -d exports ] || {{ echo MISSING_EXPORTS >&2; exit {missing_exit}; }}; }}"
+)
+
+
+# Set WPD_RSYNC_COMPRESS=0 to skip rsync compression on fast local links
+RSYNC_COMPRESS = os.environ.get("WPD_RSYNC_COMPRESS", "1") != "0"
+
+
+# Cap on rsyncs in flight (the VM pool size is set in main, see WPD_MAX_PARALLEL)
+RSYNC_SLOTS = threading.Semaphore(16)
+RSYNC_STAGGER = 0.1  # seconds between rsync starts
+
+_rsync_start_lock = threading.Lock()
+_last_rsync_start = 0.0
+
+
+@contextlib.contextmanager
+def rsync_slot():
+    """Hold one of the rsync slots, starting no sooner than RSYNC_STAGGER after the last rsync."""
+    global _last_rsync_start
+    with RSYNC_SLOTS:
+        with _rsync_start_lock:
+            delay = _last_rsync_start + RSYNC_STAGGER - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            _last_rsync_start = time.monotonic()
+        yield
+
+
+# Constant parts of every ssh / rsync invocation; per-VM options are appended per call
+BASE_SSH_OPTS = (
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "BatchMode=yes",
+    "-o", "PreferredAuthentications=publickey",
+    "-o", "IdentitiesOnly=yes",
+    # Fast AEAD cipher; compression is rsync's job, so don't do it twice
+    "-c", "aes128-gcm@openssh.com,aes128-ctr",
+    "-o", "Compression=no",
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPersist=60s",
+)
+
+BASE_RSYNC_ARGS = (
+    "rsync", "-a", "--inplace", "--partial",
+    *(("-z", "--compress-level=3") if RSYNC_COMPRESS else ()),
+)
+
+
+def write_project_file_list() -> Optional[Path]:
+    """
+    Write the project's git-visible files (tracked + untracked, minus .gitignore'd)
+    NUL-separated to a temp file for rsync --files-from. Returns None if the
+    project isn't a git checkout or git fails, in which case rsync walks the tree.
+    """
+    if not (PROJECT_ROOT / ".git").exists():
+        return None
+    try:
+        output = subprocess.check_output(
+            ["git", "-C", str(PROJECT_ROOT), "ls-files", "-z", "-co", "--exclude-standard"]
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"  git ls-files failed ({e}), falling back to a full tree walk.")
+        return None
+
+    fd, path = tempfile.mkstemp(prefix="wpd-files-", suffix=".lst")
+    with os.fdopen(fd, "wb") as f:
+        f.write(output)
+    return Path(path)
+
+
+def make_mux_dir() -> Path:
+    """
+    Private (0700) per-run directory for ControlMaster sockets, so other users can't
+    plant a socket and concurrent runs never share (or tear down) each other's master.
+    Kept directly under /tmp: a long $TMPDIR (macOS) would push socket paths past the limit.
+    """
+    return Path(tempfile.mkdtemp(prefix="wpd-mux-", dir="/tmp"))
+
+
+def mux_socket_path(mux_dir: Path, host: str) -> str:
+    """
+    ControlPath for one VM run — hashed host name so it stays under the unix socket path
+    limit, plus a random suffix so duplicate host entries each get their own master.
+    """
+    return f"{mux_dir}/{hashlib.sha1(host.encode()).hexdigest()[:10]}-{uuid.uuid4().hex[:6]}"
+
+
+# ---------------------------------------------------------------------------
+# Output dirs: finished builds are swapped into builds/<vm_name>/ in one step
+# ---------------------------------------------------------------------------
+
+_builds_swap_lock = threading.Lock()
+
+
+def swap_in_build(staging_dir: Path, output_dir: Path) -> None:
+    """
+    Replace output_dir with a fully written staging_dir. Serialized, so VMs that
+    resolve to the same name overwrite each other instead of racing on rename.
+    """
+    old_dir = None
+    with _builds_swap_lock:
+        if output_dir.exists():
+            old_dir = staging_dir.with_name(staging_dir.name.replace(".new-", ".old-", 1))
+            output_dir.rename(old_dir)
+        try:
+            staging_dir.rename(output_dir)
+        except BaseException:
+            # Put the live build back rather than leave it stranded as .old-*
+            if old_dir:
+                old_dir.rename(output_dir)
+            raise
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
 # ---------------------------------------------------------------------------
 # Core runner: send project + script, execute, pull exports/
 # ---------------------------------------------------------------------------
 
-def run_on_vm(vm_config: dict, local_script: Path) -> dict:
+def run_on_vm(vm_config: dict, local_script: Path, script_bytes: bytes, mux_dir: Path,
+              file_list: Optional[Path] = None) -> dict:
     """
     Full lifecycle for a single VM:
-      rsync project → rsync script → execute → pull exports/ → cleanup
+      rsync project → execute script → pull exports/ → cleanup
     """
     host = vm_config.get("host", "")
     password = vm_config.get("password", "")
@@ -169,123 +415,212 @@ def run_on_vm(vm_config: dict, local_script: Path) -> dict:
     # --- validate config ---
     if not host:
         return {"name": "unknown", "status": "failed", "error": "Host is not configured"}
-    if not password:
-        return {"name": host, "status": "failed", "error": "Password is not set"}
-
-    env = {**os.environ, "SSHPASS": password}
-    ssh_opts = ["-o", "StrictHostKeyChecking=no", "-o", "BatchMode=no"]
-
-    def ssh(*remote_cmd_parts):
-        return subprocess.run(
-            ["sshpass", "-e", "ssh", *ssh_opts, host, *remote_cmd_parts],
-            env=env, check=True, capture_output=True, text=True,
-        )
-
-    def rsync_to(local_src, remote_dst, excludes=None):
+    if not password and not vm_config.get("identity"):
+        return {"name": host, "status": "failed", "error": "Neither identity nor password is set"}
+
+    ssh_opts = [
+        *BASE_SSH_OPTS,
+        "-i", str(identity_path(vm_config)),
+        "-o", f"ControlPath={mux_socket_path(mux_dir, host)}",
+    ]
+    # Quoted so paths with spaces (identity, home dir) survive rsync splitting -e
+    rsync_ssh = shlex.join(["ssh", *ssh_opts])
+
+    def ssh(*remote_cmd_parts, input=None, log=None):
+        cmd = ["ssh", *ssh_opts, host, *remote_cmd_parts]
+        if log is None:
+            return subprocess.run(cmd, check=True, capture_output=True, input=input)
+
+        # Long-running commands: stream stdout+stderr to disk instead of buffering
+        # the whole output in memory; on failure only the tail is kept for the error
+        with open(log, "wb") as f:
+            try:
+                return subprocess.run(cmd, check=True, input=input,
+                                      stdout=f, stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as e:
+                raise subprocess.CalledProcessError(
+                    e.returncode, e.cmd, output=tail_file(log),
+                ) from None
+
+    def rsync_to(local_src, remote_dst, excludes=None, create_dir=False,
+                 files_from=None, whole_file=False):
         cmd = [
-            "sshpass", "-e", "rsync", "-a", "--info=progress2",
-            "-e", "ssh " + " ".join(ssh_opts),
+            *BASE_RSYNC_ARGS,
+            "-e", rsync_ssh,
                   ]
+        if whole_file:
+            # Nothing to delta against on a fresh destination — skip the checksum pass
+            cmd += ["-W"]
+        if files_from:
+            # Only send the listed paths; -r is needed explicitly so listed
+            # directories (git submodules) are still recursed. Entries deleted
+            # from the worktree but still tracked are skipped, not fatal.
+            cmd += ["--files-from", str(files_from), "--from0", "-r", "--ignore-missing-args"]
+        if create_dir:
+            # Create the destination as part of the remote rsync startup — no separate ssh
+            cmd += [f"--rsync-path=mkdir -p {remote_dst} && rsync"]
         for ex in (excludes or []):
             cmd += ["--exclude", ex]
         cmd += [str(local_src), f"{host}:{remote_dst}"]
-        subprocess.run(cmd, env=env, check=True)
+        # Progress output isn't shown anywhere, so don't collect it; keep stderr for errors
+        with rsync_slot():
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
 
-    def rsync_from(remote_src, local_dst):
+    def rsync_from(remote_src, local_dst, link_dest=None):
         cmd = [
-            "sshpass", "-e", "rsync", "-a", "--info=progress2",
-            "-e", "ssh " + " ".join(ssh_opts),
-            f"{host}:{remote_src}", str(local_dst),
+            *BASE_RSYNC_ARGS,
+            "-e", rsync_ssh,
                   ]
-        subprocess.run(cmd, env=env, check=True)
+        if link_dest:
+            # Files unchanged since link_dest are hardlinked instead of copied
+            cmd += [f"--link-dest={link_dest}"]
+        cmd += [f"{host}:{remote_src}", str(local_dst)]
+        # Progress output isn't shown anywhere, so don't collect it; keep stderr for errors
+        with rsync_slot():
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if (result.returncode == RSYNC_PARTIAL_EXIT
+                and b"No such file or directory" in result.stderr):
+            raise RuntimeError(f"{remote_src} not created on {host}")
+        result.check_returncode()
+
+    def open_master():
+        # stdio goes to /dev/null: the backgrounded master would otherwise hold our
+        # pipes open and subprocess.run would never see EOF.
+        return subprocess.run(
+            ["ssh", *ssh_opts, "-fN", host],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ).returncode
+
+    # --- open the mux master (backgrounds itself once authenticated) ---
+    # Key auth is tried first; a password-only VM that rejects it (ssh exit 255)
+    # gets the build key installed once, and every later run goes straight through.
+    returncode = open_master()
+    if returncode == 255 and not vm_config.get("identity"):
+        try:
+            provision_key(host, password)
+        except subprocess.CalledProcessError as e:
+            stderr = decode_output(e.stderr).strip()
+            return {"name": host, "status": "failed",
+                    "error": f"Key provisioning failed (exit {e.returncode}): {stderr}"}
+        returncode = open_master()
+    if returncode != 0:
+        return {"name": host, "status": "failed",
+                "error": f"SSH connect failed (exit {returncode})"}
 
-    # --- identity ---
     try:
-        vm_name = get_vm_identity(host, password)
-    except Exception as e:
-        return {"name": host, "status": "failed", "error": f"Identity probe failed: {e}"}
-
-    tmp_dir = f"/tmp/vm_runner_{uuid.uuid4().hex}"
-    output_dir = PROJECT_ROOT / "builds" / vm_name
+        # --- identity ---
+        try:
+            vm_name = get_vm_identity(host, ssh_opts)
+        except Exception as e:
+            return {"name": host, "status": "failed", "error": f"Identity probe failed: {e}"}
 
-    print(f"[{vm_name}] Starting → tmp dir: {tmp_dir}")
+        tmp_dir = f"/tmp/vm_runner_{uuid.uuid4().hex}"
+        output_dir = PROJECT_ROOT / "builds" / vm_name
 
-    try:
-        # 1. Create tmp dir on remote
-        ssh(f"mkdir -p {tmp_dir}")
-
-        # 2. Rsync project root into tmp dir
-        print(f"[{vm_name}] Syncing project root...")
-        rsync_to(
-            str(PROJECT_ROOT) + "/",  # trailing slash = contents, not the directory itself
-            tmp_dir,
-            excludes=[
-                ".git", ".build", ".env", "*.zip", "*.enc",
-                "build", "cmake-build-*", "builds",
-            ],
-            )
-
-        # 3. Rsync the script into tmp dir (explicit push so it's always current and executable)
-        print(f"[{vm_name}] Sending script: {local_script.name}")
-        rsync_to(local_script, tmp_dir + "/")
-
-        # 4. Make script executable and run it (cwd = tmp_dir)
-        # bash -e: any command failure exits immediately and propagates non-zero back to us
-        print(f"[{vm_name}] Executing {local_script.name}...")
-        result = ssh(
-            f"chmod +x {tmp_dir}/{local_script.name} && "
-            f"cd {tmp_dir} && "
-            f"bash -e {tmp_dir}/{local_script.name}"
-        )
+        run_log = None
 
-        script_output = result.stdout + result.stderr
+        print(f"[{vm_name}] Starting → tmp dir: {tmp_dir}")
 
-        # 5. Check exports/ exists
-        check = subprocess.run(
-            ["sshpass", "-e", "ssh", *ssh_opts, host,
-             f"test -d {tmp_dir}/exports && echo yes || echo no"],
-            env=env, capture_output=True, text=True,
+        try:
+            # 1. Create tmp dir on remote and rsync project root into it
+            print(f"[{vm_name}] Syncing project root...")
+            rsync_to(
+                str(PROJECT_ROOT) + "/",  # trailing slash = contents, not the directory itself
+                tmp_dir,
+                excludes=[
+                    ".git", ".build", ".env", "*.zip", "*.enc",
+                    "build", "cmake-build-*", "builds",
+                ],
+                create_dir=True,
+                files_from=file_list,
+                whole_file=True,  # tmp dir is brand new
+                )
+
+            # 2. Run the script (cwd = tmp_dir) fed over stdin and check exports/ exists,
+            # all in one remote shell; output streams to a local log
+            print(f"[{vm_name}] Executing {local_script.name}...")
+            fd, run_log = tempfile.mkstemp(prefix=f"wpd-{vm_name}-", suffix=".log")
+            os.close(fd)
+            try:
+                ssh(
+                    REMOTE_RUN_CMD.format(
+                        tmp_dir=tmp_dir,
+                        script_name=shlex.quote(local_script.name),
+                        missing_exit=EXPORTS_MISSING_EXIT,
+                    ),
+                    input=script_bytes,
+                    log=run_log,
+                )
+            except subprocess.CalledProcessError as e:
+                if e.returncode == EXPORTS_MISSING_EXIT:
+                    raise RuntimeError(
+                        f"Script finished but exports/ was not created at {tmp_dir}/exports/"
+                    ) from e
+                raise
+
+            # 3. Pull exports/ into a staging dir, hardlinking files unchanged since the
+            # current build; the live builds/<vm_name>/ isn't touched until step 5
+            staging_dir = output_dir.with_name(f"{vm_name}.new-{uuid.uuid4().hex[:8]}")
+            staging_dir.mkdir(parents=True)
+            print(f"[{vm_name}] Pulling exports/...")
+            try:
+                rsync_from(
+                    f"{tmp_dir}/exports/", str(staging_dir) + "/",
+                    link_dest=output_dir if output_dir.is_dir() else None,
+                )
+
+                # 4. Save script stdout/stderr alongside exports
+                shutil.move(run_log, staging_dir / "run.log")
+
+                # 5. Swap the finished build in
+                swap_in_build(staging_dir, output_dir)
+            except BaseException:
+                # Never leave a half-built .new-* behind; keep the log where the error points
+                staged_log = staging_dir / "run.log"
+                if staged_log.exists():
+                    shutil.move(staged_log, run_log)
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+
+            # 6. Cleanup tmp on success
+            ssh(f"rm -rf {tmp_dir}")
+            print(f"[{vm_name}] ✓ Done → {output_dir}")
+
+            return {
+                "name": vm_name,
+                "host": host,
+                "status": "success",
+                "output_dir": str(output_dir),
+            }
+
+        except subprocess.CalledProcessError as e:
+            stderr = decode_output(e.stderr).strip()
+            stdout = decode_output(e.stdout).strip()
+            error = f"Command failed (exit {e.returncode})"
+            if stdout:
+                error += f"\noutput (tail): {stdout}"
+            if stderr:
+                error += f"\nstderr: {stderr}"
+            if run_log and os.path.exists(run_log):
+                error += f"\nfull log: {run_log}"
+            print(f"[{vm_name}] ✗ Failed — tmp left at {tmp_dir} for debugging")
+            return {"name": vm_name, "host": host, "status": "failed",
+                    "error": error, "tmp_dir": tmp_dir}
+
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if run_log and os.path.exists(run_log):
+                error += f"\nfull log: {run_log}"
+            print(f"[{vm_name}] ✗ Failed — tmp left at {tmp_dir} for debugging")
+            return {"name": vm_name, "host": host, "status": "failed",
+                    "error": error, "tmp_dir": tmp_dir}
+
+    finally:
+        # Tear down the mux master; harmless if ControlPersist already expired it
+        subprocess.run(
+            ["ssh", *ssh_opts, "-O", "exit", host],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
         )
-        if check.stdout.strip() != "yes":
-            raise RuntimeError(
-                f"Script finished but exports/ was not created at {tmp_dir}/exports/"
-            )
-
-        # 6. Pull exports/ back
-        output_dir.mkdir(parents=True, exist_ok=True)
-        print(f"[{vm_name}] Pulling exports/...")
-        rsync_from(f"{tmp_dir}/exports/", str(output_dir) + "/")
-
-        # 7. Save script stdout/stderr alongside exports
-        (output_dir / "run.log").write_text(script_output)
-
-        # 8. Cleanup tmp on success
-        ssh(f"rm -rf {tmp_dir}")
-        print(f"[{vm_name}] ✓ Done → {output_dir}")
-
-        return {
-            "name": vm_name,
-            "host": host,
-            "status": "success",
-            "output_dir": str(output_dir),
-        }
-
-    except subprocess.CalledProcessError as e:
-        stderr = e.stderr.strip() if e.stderr else ""
-        stdout = e.stdout.strip() if e.stdout else ""
-        error = f"Command failed (exit {e.returncode})"
-        if stdout:
-            error += f"\nstdout: {stdout}"
-        if stderr:
-            error += f"\nstderr: {stderr}"
-        print(f"[{vm_name}] ✗ Failed — tmp left at {tmp_dir} for debugging")
-        return {"name": vm_name, "host": host, "status": "failed",
-                "error": error, "tmp_dir": tmp_dir}
-
-    except Exception as e:
-        print(f"[{vm_name}] ✗ Failed — tmp left at {tmp_dir} for debugging")
-        return {"name": vm_name, "host": host, "status": "failed",
-                "error": f"{type(e).__name__}: {e}", "tmp_dir": tmp_dir}
 
 
 # ---------------------------------------------------------------------------
@@ -293,40 +628,87 @@ def run_on_vm(vm_config: dict, local_script: Path) -> dict:
 # ---------------------------------------------------------------------------
 
 def main():
-    # Resolve faster routes upfront (sequential is fine, network probing is fast)
-    resolved_configs = []
+    valid_configs = []
     for config in VM_CONFIGS:
         if not config.get("host"):
             print(f"✗ Skipping entry with no host: {config}")
             continue
-        if not config.get("password"):
-            print(f"✗ {config['host']}: Password not set, skipping.")
+        if not config.get("password") and not config.get("identity"):
+            print(f"✗ {config['host']}: Neither identity nor password set, skipping.")
             continue
-        resolved_configs.append(resolve_host(config))
+        if config.get("identity"):
+            identity = identity_path(config)
+            if not identity.is_file() or not os.access(identity, os.R_OK):
+                print(f"✗ {config['host']}: identity {identity} is not a readable file, skipping.")
+                continue
+        valid_configs.append(config)
+
+    # Resolve faster routes upfront. Probes are independent and oroute can sit on
+    # multi-second timeouts, so run them concurrently.
+    resolved_configs = valid_configs
+    if not OROUTE_AVAILABLE:
+        print(f"oroute not found at {OROUTE_BIN}, skipping route resolution.")
+    elif valid_configs:
+        with ThreadPoolExecutor(max_workers=min(16, len(valid_configs))) as executor:
+            resolved_configs = list(executor.map(resolve_host, valid_configs))
 
     if not resolved_configs:
         print("✗ No valid VM configurations found.")
         sys.exit(1)
 
+    # Bounded VM pool; WPD_MAX_PARALLEL overrides the size
+    max_workers = min(32, max(4, len(resolved_configs)))
+    max_parallel = os.environ.get("WPD_MAX_PARALLEL")
+    if max_parallel:
+        try:
+            max_workers = max(1, int(max_parallel))
+        except ValueError:
+            print(f"✗ WPD_MAX_PARALLEL must be an integer, got {max_parallel!r}. Aborting.")
+            sys.exit(1)
+
     print(f"\nRunning '{script_path.name}' on {len(resolved_configs)} VM(s) in parallel...\n")
 
+    # Read the script once; every VM gets it over ssh stdin, so no separate rsync is needed
+    script_bytes = script_path.read_bytes()
+
+    # List the project files once for every VM's push instead of each rsync walking the tree
+    file_list = write_project_file_list()
+
     results = []
-    with ThreadPoolExecutor(max_workers=len(resolved_configs)) as executor:
-        futures = {
-            executor.submit(run_on_vm, vm, script_path): vm
-            for vm in resolved_configs
-        }
-        for future in as_completed(futures):
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                vm = futures[future]
-                results.append({
-                    "name": vm.get("host", "unknown"),
-                    "status": "failed",
-                    "error": f"Unhandled executor error: {e}",
-                })
+    with contextlib.ExitStack() as cleanup:
+        if file_list:
+            cleanup.callback(file_list.unlink, missing_ok=True)
+
+        mux_dir = make_mux_dir()
+        cleanup.callback(shutil.rmtree, mux_dir, ignore_errors=True)
+
+        # One agent for the whole run: each key is unlocked once and every ssh/rsync
+        # authenticates through it
+        identities = {identity_path(vm) for vm in resolved_configs}
+        try:
+            if DEFAULT_IDENTITY in identities:
+                ensure_default_identity()
+            cleanup.enter_context(ssh_agent(identities))
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"✗ Failed to set up ssh-agent: {e}. Aborting.")
+            sys.exit(1)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(run_on_vm, vm, script_path, script_bytes, mux_dir, file_list): vm
+                for vm in resolved_configs
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    results.append(result)
+                except Exception as e:
+                    vm = futures[future]
+                    results.append({
+                        "name": vm.get("host", "unknown"),
+                        "status": "failed",
+                        "error": f"Unhandled executor error: {e}",
+                    })
 
     # --- Summary ---
     print("\n=== Run Summary ===")
@@ -22,12 +22,48 @@ from typing import Optional, Dict, Any
 
 
 class WpDaemonClient:
-    """Simple TCP client for WpDaemon using only stdlib."""
+    """Simple TCP client for WpDaemon using only stdlib.
+    
+    Keeps one connection open across commands (responses are newline-framed)
+    and reconnects transparently if the daemon drops it.
+    """
     
     def __init__(self, host: str = "127.0.0.1", port: int = 23888, timeout: float = 5.0):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+    
+    def _connect(self) -> None:
+        """Open the persistent connection if it isn't already."""
+        if self._sock is not None:
+            return
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock = sock
+        self._file = sock.makefile('rwb', buffering=8192)
+    
+    def close(self) -> None:
+        """Close the persistent connection (safe to call repeatedly)."""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+    
+    def _exchange(self, payload: bytes) -> bytes:
+        """Write one command and read exactly one newline-terminated response."""
+        self._connect()
+        self._file.write(payload)
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionResetError("Daemon closed the connection")
+        return line
     
     def send_command(self, command: str) -> Dict[str, Any]:
         """
@@ -47,27 +83,21 @@ class WpDaemonClient:
         # Ensure command ends with newline
         if not command.endswith('\n'):
             command += '\n'
-        
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(self.timeout)
+        payload = command.encode('utf-8')
         
         try:
-            sock.connect((self.host, self.port))
-            sock.sendall(command.encode('utf-8'))
-            
-            # Read response until newline
-            response_data = b""
-            while b'\n' not in response_data:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response_data += chunk
-            
-            response_str = response_data.decode('utf-8').strip()
-            return json.loads(response_str)
-            
-        finally:
-            sock.close()
+            try:
+                line = self._exchange(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # Stale connection (daemon restarted or dropped us) - retry once on a fresh one
+                self.close()
+                line = self._exchange(payload)
+        except Exception:
+            # Don't reuse a connection whose framing may now be out of sync
+            self.close()
+            raise
+        
+        return json.loads(line.decode('utf-8').strip())
     
     def is_available(self) -> bool:
         """Check if daemon is reachable."""
@@ -95,6 +125,11 @@ class TestWpDaemon(unittest.TestCase):
                 f"Start it first with: ./WpDaemon"
             )
     
+    @classmethod
+    def tearDownClass(cls):
+        """Close the shared client connection."""
+        cls.client.close()
+    
     def test_whoami(self):
         """Test whoami command returns version info."""
         response = self.client.send_command("whoami:")
@@ -191,6 +226,11 @@ class TestWpDaemonLifecycle(unittest.TestCase):
         configs = cls.client.send_command("available_confs:")
         cls.available_configs = configs["result"]["configs"]
     
+    @classmethod
+    def tearDownClass(cls):
+        """Close the shared client connection."""
+        cls.client.close()
+    
     def setUp(self):
         """Ensure clean state before each test."""
         # Stop any running proxy